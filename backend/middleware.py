@@ -0,0 +1,61 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .routers import reset_pin
+
+logger = logging.getLogger(__name__)
+
+
+class QueryReport:
+    def __init__(self):
+        self.queries = {}
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            alias = context['connection'].alias
+            self.queries[alias] = self.queries.get(alias, 0) + 1
+
+    @property
+    def count(self):
+        return sum(self.queries.values())
+
+
+class QueryReportMiddleware:
+    """
+    Count the queries and DB time of each request, per database alias.
+
+    The totals are logged, and returned in the Server-Timing and X-DB-Queries
+    response headers when QUERY_REPORT_HEADERS is on. Also starts every request
+    unpinned from the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        report = QueryReport()
+        reset_pin()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(report))
+                response = self.get_response(request)
+        finally:
+            reset_pin()
+
+        duration_ms = report.duration * 1000
+        per_alias = ', '.join(f"{alias}={count}" for alias, count in sorted(report.queries.items()))
+        if settings.QUERY_REPORT_HEADERS:
+            response['Server-Timing'] = f'db;desc="{report.count} queries";dur={duration_ms:.1f}'
+            response['X-DB-Queries'] = per_alias
+        logger.info("%s %s: %d queries in %.1fms (%s)", request.method, request.path, report.count, duration_ms, per_alias)
+        return response
@@ -0,0 +1,47 @@
+"""
+Database router sending read-only ORM traffic to optional replicas.
+
+Every alias in settings.DATABASE_REPLICAS is treated as a read replica of
+'default'. Writes always go to the primary, and once a request has written
+(or is inside a transaction) its remaining reads stay on the primary too so it
+sees its own writes.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = 'default'
+
+_pinned = ContextVar('pinned_to_primary', default=False)
+
+
+def pin_to_primary():
+    _pinned.set(True)
+
+
+def reset_pin():
+    _pinned.set(False)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or _pinned.get() or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {PRIMARY, *getattr(settings, 'DATABASE_REPLICAS', [])}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication
+        return db == PRIMARY
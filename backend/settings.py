@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'backend.middleware.QueryReportMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,9 +95,39 @@ DATABASES = {
         'PASSWORD': '',   
         'HOST': 'localhost',           
         'PORT': '3306',               
+        # Keep connections open between requests, checking them before reuse
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas of 'default', as alias -> overrides of the primary settings,
+# e.g. {'replica': {'HOST': 'replica.local'}}. Read-only ORM traffic is spread
+# across them by backend.routers.PrimaryReplicaRouter.
+REPLICA_DATABASES = {}
+
+if os.environ.get('DJANGO_SQLITE'):
+    # Local stand-ins for the primary and one replica. The replica is a second
+    # connection to the same file, so it always has the primary's data
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': 60,
+            'CONN_HEALTH_CHECKS': True,
+        },
+    }
+    REPLICA_DATABASES = {
+        'replica': {},
+    }
+
+for alias, overrides in REPLICA_DATABASES.items():
+    # Tests run the replica against the primary's test database
+    DATABASES[alias] = {**DATABASES['default'], **overrides, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_REPLICAS = list(REPLICA_DATABASES)
+DATABASE_ROUTERS = ['backend.routers.PrimaryReplicaRouter']
+
 
 
 # Password validation
@@ -162,3 +194,83 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
+
+# Send each request's query counts and DB time back in the Server-Timing and
+# X-DB-Queries headers; they are always logged by backend.middleware
+QUERY_REPORT_HEADERS = DEBUG
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'backend': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+# Recommendation index: neighbours kept per movie, and how far appended rows may
+# drift from the fitted vocabulary (share of new rows or unseen tokens) before
+# the index is rebuilt from scratch
+RECOMMENDER_NEIGHBOURS = 20
+RECOMMENDER_REBUILD_THRESHOLD = 0.25
+
+# Per-process cap on concurrent recommendation scoring; requests wait up to
+# RECOMMENDER_QUEUE_TIMEOUT seconds for a slot, and coalesced requests up to
+# RECOMMENDER_COALESCE_TIMEOUT seconds for the shared result, before getting a
+# 503 with Retry-After: RECOMMENDER_RETRY_AFTER
+RECOMMENDER_MAX_CONCURRENCY = 4
+RECOMMENDER_QUEUE_TIMEOUT = 0.5
+RECOMMENDER_COALESCE_TIMEOUT = 15
+RECOMMENDER_RETRY_AFTER = 1
+
+# Seconds to wait on TMDB for each poster lookup
+POSTER_FETCH_TIMEOUT = 2
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# 'versions' holds only the recommendation dataset version, so evicting
+# results and posters from 'default' can never drop it. Without REDIS_URL both
+# are per-process; with Redis the version key has no expiry, so a volatile-*
+# maxmemory-policy never evicts it.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+        'versions': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': 'versions',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'default',
+        },
+        'versions': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'versions',
+        },
+    }
+
+# Recommendation results: in-process LRU (entries, seconds) in front of the
+# shared cache above, and how long results and TMDB poster URLs stay shared.
+# Results with a failed poster lookup are only kept for the partial TTL.
+RECOMMENDATION_CACHE_SIZE = 1024
+RECOMMENDATION_CACHE_TTL = 60
+RECOMMENDATION_SHARED_CACHE_TTL = 60 * 60
+RECOMMENDATION_PARTIAL_CACHE_TTL = 30
+RECOMMENDATION_VERSION_CACHE = 'versions'
+POSTER_CACHE_TTL = 60 * 60 * 24
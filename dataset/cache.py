@@ -0,0 +1,114 @@
+"""
+Two-tier cache for recommendation results.
+
+Results are kept in a small in-process LRU in front of Django's shared cache.
+Keys carry a dataset version kept in its own shared cache (so it is never
+culled along with results), and replacing the version on upload invalidates
+every cached result in one write.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+VERSION_KEY = 'recommendations:version'
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RecommendationCache:
+    def __init__(self):
+        self.local = LRUCache(settings.RECOMMENDATION_CACHE_SIZE, settings.RECOMMENDATION_CACHE_TTL)
+        self._lock = threading.Lock()
+        self._counters = {"local_hits": 0, "shared_hits": 0, "misses": 0}
+
+    def version(self):
+        versions = caches[settings.RECOMMENDATION_VERSION_CACHE]
+        version = versions.get(VERSION_KEY)
+        if version is None:
+            # add() keeps whichever process got there first
+            versions.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+            version = versions.get(VERSION_KEY)
+        return version
+
+    def invalidate(self):
+        """
+        Move to a new dataset version, orphaning every previously cached result.
+        """
+        caches[settings.RECOMMENDATION_VERSION_CACHE].set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+    def key(self, view, dataset_pk, movie_id, k):
+        return f"recommendations:{self.version()}:{view}:{dataset_pk}:{movie_id}:{k}"
+
+    def get(self, key):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count("local_hits")
+            return value
+
+        entry = cache.get(key, _MISSING)
+        if entry is not _MISSING:
+            # Keep it locally no longer than it has left in the shared tier
+            expires, value = entry
+            remaining = expires - time.time()
+            if remaining > 0:
+                self._count("shared_hits")
+                self.local.set(key, value, ttl=remaining)
+                return value
+
+        self._count("misses")
+        return None
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = settings.RECOMMENDATION_SHARED_CACHE_TTL
+        self.local.set(key, value, ttl=timeout)
+        cache.set(key, (time.time() + timeout, value), timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters["local_size"] = len(self.local)
+        counters["version"] = self.version()
+        return counters
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+recommendation_cache = RecommendationCache()
@@ -0,0 +1,84 @@
+"""
+Request coalescing and admission control for the recommendation views.
+
+SingleFlight lets concurrent identical requests share one computation, and
+ConcurrencyLimiter caps how many scoring calls run at once per process,
+queueing briefly before shedding load.
+"""
+import copy
+import threading
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _copy_error(error):
+    # Each follower raises its own copy, one exception object raised in
+    # several threads at once would have its traceback rewritten by all of them
+    try:
+        return copy.copy(error)
+    except Exception:
+        return RuntimeError(f"Coalesced call failed: {error!r}")
+
+
+class SingleFlight:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Run `fn` once for all callers arriving with the same `key` while it is in flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            # Wait for the first caller and share its result (or its error)
+            if not call.done.wait(self.timeout):
+                raise Overloaded()
+            if call.error is not None:
+                raise _copy_error(call.error) from call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit, timeout):
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one of the limited slots, raising Overloaded if none frees up in time.
+        """
+        if not self._semaphore.acquire(timeout=self.timeout):
+            raise Overloaded()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
@@ -0,0 +1,396 @@
+"""
+In-process similarity index used by the recommendation views.
+
+The TF-IDF model and each movie's nearest neighbours are computed once per
+dataset. Rows appended to the dataset CSV afterwards are vectorized with the
+stored vocabulary and document frequencies, added to the stored matrix, and
+merged into the existing neighbour lists, so a refresh costs time proportional
+to the appended rows instead of refitting the whole catalog. A full rebuild
+only runs once the appended rows drift past RECOMMENDER_REBUILD_THRESHOLD.
+"""
+import io
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from django.conf import settings
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+try:
+    import fcntl
+except ImportError:  # Windows, appends are then only serialised within a process
+    fcntl = None
+
+REQUIRED_COLUMNS = {'movie_id', 'title', 'cast', 'crew'}
+
+# Number of rows scored at once when computing neighbours, bounds the size of
+# the dense similarity block held in memory.
+CHUNK_SIZE = 1000
+
+
+class DatasetError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message, status_code)
+        self.message = message
+        self.status_code = status_code
+
+    def __str__(self):
+        return self.message
+
+
+def extract_names(column):
+    # cast/crew columns hold a JSON list of people, keep only their names
+    try:
+        people = json.loads(column)
+        return ' '.join([person['name'] for person in people if 'name' in person])
+    except (json.JSONDecodeError, TypeError):
+        return ''
+
+
+def combine_raw(df):
+    return df['title'].fillna('') + ' ' + df['cast'].fillna('') + ' ' + df['crew'].fillna('')
+
+
+def combine_names(df):
+    cast_names = df['cast'].apply(extract_names)
+    crew_names = df['crew'].apply(extract_names)
+    return df['title'].fillna('') + ' ' + cast_names.fillna('') + ' ' + crew_names.fillna('')
+
+
+COMBINERS = {
+    'raw': combine_raw,
+    'names': combine_names,
+}
+
+
+class MovieIndex:
+    def __init__(self, path, combine):
+        self.path = path
+        self.combine = combine
+        self.lock = threading.Lock()
+        self.n_neighbours = getattr(settings, 'RECOMMENDER_NEIGHBOURS', 20)
+        self.rebuild_threshold = getattr(settings, 'RECOMMENDER_REBUILD_THRESHOLD', 0.25)
+        self._rebuild()
+
+    def recommend(self, movie_id, limit=5):
+        """
+        Return up to `limit` most similar movies, or None if the movie is unknown.
+        """
+        with self.lock:
+            position = self.positions.get(str(movie_id).strip())
+            if position is None:
+                return None
+            return [
+                {
+                    "movie_id": self.movie_ids[idx],
+                    "title": self.titles[idx],
+                    "similarity_score": float(score),
+                }
+                for idx, score in zip(self.neighbours[position, :limit], self.scores[position, :limit])
+            ]
+
+    def refresh(self):
+        """
+        Pick up rows appended to the CSV since the last fit or refresh.
+        """
+        with self.lock:
+            size = os.path.getsize(self.path)
+            if size < self.offset:
+                # The file was replaced or truncated, nothing to append to
+                self._rebuild()
+                return
+            if size == self.offset:
+                return
+
+            with open(self.path, 'rb') as csvfile:
+                csvfile.seek(self.offset)
+                data = csvfile.read()
+
+            # Only consume complete lines, a concurrent writer may be mid-row
+            data = data[:data.rfind(b'\n') + 1]
+            if not data:
+                return
+
+            try:
+                new_rows = _read_rows(data, header=None, names=self.columns)
+                appended = new_rows.empty or self._append(new_rows)
+            except Exception as e:
+                raise DatasetError(f"Failed to load appended rows: {str(e)}", 500)
+            if not appended:
+                # _rebuild() re-reads the whole file and moves the offset itself
+                self._rebuild()
+                return
+
+            # Only move past the rows once they are in the index, so a failure
+            # above is retried on the next refresh
+            self.offset += len(data)
+
+    def drift(self):
+        return self._drift(self.appended_rows, self.appended_tokens, self.unknown_tokens)
+
+    def _drift(self, appended_rows, appended_tokens, unknown_tokens):
+        # Share of the catalog added since the last fit, or share of appended
+        # tokens the fitted vocabulary has never seen, whichever is worse
+        grown = appended_rows / max(self.fitted_rows, 1)
+        unknown = unknown_tokens / max(appended_tokens, 1)
+        return max(grown, unknown)
+
+    def _rebuild(self):
+        """
+        Refit on the whole file. Leaves the index untouched if anything fails.
+        """
+        try:
+            # Whole file, including a last row without a newline; the shared
+            # lock keeps appenders from being mid-row while we read
+            with _locked_file(self.path, shared=True) as csvfile:
+                data = csvfile.read()
+            df = _read_rows(data)
+        except Exception as e:
+            raise DatasetError(f"Failed to load dataset: {str(e)}", 500)
+
+        if not REQUIRED_COLUMNS.issubset(df.columns):
+            raise DatasetError(f"Dataset must contain columns: {REQUIRED_COLUMNS}", 400)
+
+        try:
+            vectorizer = TfidfVectorizer(stop_words='english')
+            matrix = vectorizer.fit_transform(self.combine(df)).tocsr()
+            neighbours, scores = self._top_k(matrix)
+        except Exception as e:
+            raise DatasetError(f"Failed to index dataset: {str(e)}", 500)
+
+        self.offset = len(data)
+        self.columns = list(df.columns)
+        self.vectorizer = vectorizer
+        self.analyzer = vectorizer.build_analyzer()
+        self.matrix = matrix
+        self.neighbours, self.scores = neighbours, scores
+
+        self.movie_ids = df['movie_id'].tolist()
+        self.titles = df['title'].tolist()
+        self.positions = {}
+        self._index_positions(0)
+
+        self.fitted_rows = len(df)
+        self.appended_rows = 0
+        self.appended_tokens = 0
+        self.unknown_tokens = 0
+
+    def _append(self, df):
+        """
+        Add rows to the fitted index. Returns False when a full rebuild is needed instead.
+
+        Nothing is changed until the new neighbour lists are computed, so an
+        error leaves the index as it was.
+        """
+        texts = self.combine(df)
+        tokens = [token for text in texts for token in self.analyzer(text)]
+        appended_rows = self.appended_rows + len(df)
+        appended_tokens = self.appended_tokens + len(tokens)
+        unknown_tokens = self.unknown_tokens + sum(1 for token in tokens if token not in self.vectorizer.vocabulary_)
+        if self._drift(appended_rows, appended_tokens, unknown_tokens) > self.rebuild_threshold:
+            return False
+
+        start = self.matrix.shape[0]
+        if self.neighbours.shape[1] < min(self.n_neighbours, start + len(df) - 1):
+            # Catalog was smaller than the neighbour list, lists must be widened
+            return False
+
+        rows = self.vectorizer.transform(texts).tocsr()
+        neighbours, scores, patches = self._patch_neighbours(rows, start)
+
+        for positions, patched_neighbours, patched_scores in patches:
+            self.neighbours[positions] = patched_neighbours
+            self.scores[positions] = patched_scores
+        self.matrix = sp.vstack([self.matrix, rows], format='csr')
+        self.movie_ids.extend(df['movie_id'].tolist())
+        self.titles.extend(df['title'].tolist())
+        self._index_positions(start)
+        self.neighbours = np.vstack([self.neighbours, neighbours])
+        self.scores = np.vstack([self.scores, scores])
+        self.appended_rows = appended_rows
+        self.appended_tokens = appended_tokens
+        self.unknown_tokens = unknown_tokens
+        return True
+
+    def _index_positions(self, start):
+        # First occurrence wins, like looking the movie up in the dataframe
+        for idx in range(start, len(self.movie_ids)):
+            self.positions.setdefault(str(self.movie_ids[idx]), idx)
+
+    def _top_k(self, matrix):
+        """
+        Neighbours of every row of `matrix`, used for a full rebuild.
+        """
+        n_rows = matrix.shape[0]
+        k = max(min(self.n_neighbours, n_rows - 1), 0)
+        neighbours = np.empty((n_rows, k), dtype=np.int64)
+        scores = np.empty((n_rows, k))
+        if k == 0:
+            return neighbours, scores
+
+        # TF-IDF rows are L2 normalised, so the dot product is the cosine similarity
+        matrix_t = matrix.T.tocsr()
+        for begin in range(0, n_rows, CHUNK_SIZE):
+            sims = (matrix[begin:begin + CHUNK_SIZE] @ matrix_t).toarray()
+            chunk = np.arange(sims.shape[0])
+            sims[chunk, begin + chunk] = -np.inf  # exclude the movie itself
+
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            neighbours[begin:begin + len(chunk)] = np.take_along_axis(top, order, axis=1)
+            scores[begin:begin + len(chunk)] = np.take_along_axis(top_scores, order, axis=1)
+        return neighbours, scores
+
+    def _patch_neighbours(self, rows, start):
+        """
+        Compute the neighbour lists of `rows` (to be stored from `start`), and the
+        patched lists of the existing movies they beat as (positions, neighbours,
+        scores) updates.
+
+        Each block of similarities between existing movies and the new rows is
+        computed once and used in both directions.
+        """
+        k = self.neighbours.shape[1]
+        new_ids = start + np.arange(rows.shape[0])
+        rows_t = rows.T.tocsr()
+
+        # The new rows start out as candidates for each other
+        sims = (rows @ rows_t).toarray()
+        sims[np.arange(rows.shape[0]), np.arange(rows.shape[0])] = -np.inf  # exclude the movie itself
+        neighbours = np.full((rows.shape[0], k), -1, dtype=np.int64)
+        scores = np.full((rows.shape[0], k), -np.inf)
+        neighbours, scores = _merge_top_k(neighbours, scores, new_ids, sims)
+
+        patches = []
+        for begin in range(0, start, CHUNK_SIZE):
+            end = min(begin + CHUNK_SIZE, start)
+            sims = (self.matrix[begin:end] @ rows_t).toarray()
+
+            # Existing movies as candidates for the new rows
+            neighbours, scores = _merge_top_k(neighbours, scores, np.arange(begin, end), sims.T)
+
+            # Only movies whose weakest neighbour is beaten by a new row change
+            affected = np.flatnonzero(sims.max(axis=1) > self.scores[begin:end, -1])
+            if not affected.size:
+                continue
+            positions = begin + affected
+            patches.append((positions, *_merge_top_k(
+                self.neighbours[positions], self.scores[positions], new_ids, sims[affected]
+            )))
+        return neighbours, scores, patches
+
+
+def _movie_id(value):
+    # Ids are read as text so one empty cell cannot turn the column into floats
+    value = value.strip()
+    return int(value) if value.isdigit() else value
+
+
+def _read_rows(data, **kwargs):
+    """
+    Parse CSV bytes, keeping only rows that have a movie_id.
+    """
+    df = pd.read_csv(io.BytesIO(data), dtype={'movie_id': str}, **kwargs)
+    if 'movie_id' in df.columns:
+        df = df[df['movie_id'].notna() & (df['movie_id'].str.strip() != '')]
+        df = df.assign(movie_id=df['movie_id'].map(_movie_id))
+    return df
+
+
+def _merge_top_k(neighbours, scores, candidate_ids, candidate_scores):
+    """
+    Merge candidates (ids shared by every row) into sorted per-row top-k lists.
+    """
+    k = neighbours.shape[1]
+    candidate_ids = np.broadcast_to(candidate_ids, candidate_scores.shape)
+    if candidate_scores.shape[1] > k:
+        top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+        candidate_ids = np.take_along_axis(candidate_ids, top, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, top, axis=1)
+
+    # Current neighbours come first so they keep their place on ties
+    all_ids = np.hstack([neighbours, candidate_ids])
+    all_scores = np.hstack([scores, candidate_scores])
+    order = np.argsort(-all_scores, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(all_ids, order, axis=1), np.take_along_axis(all_scores, order, axis=1)
+
+
+_indexes = {}
+_building = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(dataset, kind):
+    """
+    Return the index of `dataset` for the given text `kind`, fitting it on first use.
+    """
+    key = (dataset.pk, dataset.file.name, kind)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            build_lock = _building.setdefault(key, threading.Lock())
+
+    if index is None:
+        # Fit outside the registry lock so other datasets and kinds are not held up
+        with build_lock:
+            with _indexes_lock:
+                index = _indexes.get(key)
+            if index is None:
+                index = MovieIndex(dataset.file.path, COMBINERS[kind])
+                with _indexes_lock:
+                    _indexes[key] = index
+                    _building.pop(key, None)
+                return index
+
+    # Another process may have appended rows since we last looked
+    index.refresh()
+    return index
+
+
+_file_locks = {}
+
+
+@contextmanager
+def _locked_file(path, shared=False):
+    """
+    Open `path` for appending, or for reading when `shared`, locked against
+    appends from other threads and processes.
+    """
+    with _indexes_lock:
+        thread_lock = _file_locks.setdefault(path, threading.Lock())
+    with thread_lock, open(path, 'rb' if shared else 'a+b') as csvfile:
+        if fcntl is not None:
+            fcntl.flock(csvfile, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield csvfile
+        finally:
+            if fcntl is not None:
+                fcntl.flock(csvfile, fcntl.LOCK_UN)
+
+
+def append_rows(dataset, new_rows):
+    """
+    Append `new_rows` to the dataset CSV and refresh the loaded indexes.
+    """
+    path = dataset.file.path
+    columns = pd.read_csv(path, nrows=0).columns
+    data = new_rows.reindex(columns=columns).to_csv(header=False, index=False, lineterminator='\n')
+
+    with _locked_file(path) as csvfile:
+        csvfile.seek(0, os.SEEK_END)
+        needs_newline = csvfile.tell() > 0
+        if needs_newline:
+            csvfile.seek(-1, os.SEEK_END)
+            needs_newline = csvfile.read(1) != b'\n'
+        csvfile.write((('\n' if needs_newline else '') + data).encode('utf-8'))
+        csvfile.flush()
+
+    with _indexes_lock:
+        indexes = [index for key, index in _indexes.items() if key[0] == dataset.pk]
+    for index in indexes:
+        index.refresh()
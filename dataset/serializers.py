@@ -1,7 +1,10 @@
 from rest_framework import serializers
-from .models import Dataset
+from .models import Dataset, validate_csv_file
 
 class DatasetSerializer(serializers.ModelSerializer):
     class Meta:
         model = Dataset
         fields = ['id', 'name', 'file']
+
+class DatasetAppendSerializer(serializers.Serializer):
+    file = serializers.FileField(validators=[validate_csv_file])
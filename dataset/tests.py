@@ -1,3 +1,404 @@
-from django.test import TestCase
+import os
+import random
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from . import recommender, views
+from .cache import LRUCache, RecommendationCache
+from .concurrency import ConcurrencyLimiter, Overloaded, SingleFlight
+from .models import Dataset
+
+NAMES = [f"name{i}" for i in range(40)]
+
+
+def make_rows(start, count, seed):
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        'movie_id': range(start, start + count),
+        'title': [f"Movie{i}" for i in range(start, start + count)],
+        'cast': [' '.join(rng.sample(NAMES, 4)) for _ in range(count)],
+        'crew': [' '.join(rng.sample(NAMES, 2)) for _ in range(count)],
+    })
+
+
+@override_settings(RECOMMENDER_NEIGHBOURS=5, RECOMMENDER_REBUILD_THRESHOLD=10)
+class MovieIndexTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'movies.csv')
+        make_rows(0, 40, seed=1).to_csv(self.path, index=False)
+        self.dataset = SimpleNamespace(pk=1, file=SimpleNamespace(path=self.path, name='datasets/movies.csv'))
+        self.addCleanup(recommender._indexes.clear)
+
+    def assertNeighboursMatchRebuild(self, index):
+        # Recomputing every neighbour list over the same matrix is what a full
+        # rebuild with the fitted vocabulary would give
+        expected_neighbours, expected_scores = index._top_k(index.matrix)
+        np.testing.assert_allclose(index.scores, expected_scores)
+        sims = (index.matrix @ index.matrix.T).toarray()
+        for row, (neighbours, scores) in enumerate(zip(index.neighbours, index.scores)):
+            self.assertNotIn(row, neighbours)
+            self.assertEqual(len(set(neighbours)), len(neighbours))
+            np.testing.assert_allclose(sims[row, neighbours], scores)
+
+    def test_append_patches_neighbours(self):
+        index = recommender.get_index(self.dataset, 'raw')
+        recommender.append_rows(self.dataset, make_rows(40, 8, seed=2))
+
+        self.assertEqual(index.matrix.shape[0], 48)
+        self.assertEqual(index.fitted_rows, 40)
+        self.assertIsNotNone(index.recommend(45))
+        self.assertNeighboursMatchRebuild(index)
+
+    def test_repeated_appends(self):
+        index = recommender.get_index(self.dataset, 'raw')
+        for batch in range(3):
+            recommender.append_rows(self.dataset, make_rows(40 + batch * 3, 3, seed=batch))
+        self.assertEqual(index.matrix.shape[0], 49)
+        self.assertNeighboursMatchRebuild(index)
+
+    @override_settings(RECOMMENDER_REBUILD_THRESHOLD=0.1)
+    def test_drift_triggers_rebuild(self):
+        index = recommender.get_index(self.dataset, 'raw')
+        recommender.append_rows(self.dataset, make_rows(40, 8, seed=2))
+
+        self.assertEqual(index.fitted_rows, 48)
+        fresh = recommender.MovieIndex(self.path, recommender.combine_raw)
+        np.testing.assert_allclose(index.scores, fresh.scores)
+
+    def test_last_row_without_newline(self):
+        with open(self.path, 'a') as csvfile:
+            csvfile.write('40,Movie40,name1 name2,name3')
+        index = recommender.get_index(self.dataset, 'raw')
+        self.assertEqual(index.matrix.shape[0], 41)
+        self.assertIsNotNone(index.recommend(40))
+
+        recommender.append_rows(self.dataset, make_rows(41, 1, seed=2))
+        self.assertEqual(index.matrix.shape[0], 42)
+        self.assertIsNotNone(index.recommend(41))
+        self.assertEqual(len(pd.read_csv(self.path)), 42)
+
+    def test_rows_without_movie_id(self):
+        with open(self.path, 'a') as csvfile:
+            csvfile.write(',Untitled,name1,name2\n')
+        index = recommender.get_index(self.dataset, 'raw')
+        self.assertEqual(index.matrix.shape[0], 40)
+        self.assertEqual(index.positions['1'], 1)
+        self.assertIsInstance(index.recommend('1')[0]["movie_id"], int)
+
+        with open(self.path, 'a') as csvfile:
+            csvfile.write(',Untitled,name1,name2\n40,Movie40,name1 name2,name3\n')
+        index.refresh()
+        self.assertEqual(index.matrix.shape[0], 41)
+        self.assertIsNotNone(index.recommend(40))
+
+    def test_failed_refresh_is_retried(self):
+        index = recommender.get_index(self.dataset, 'raw')
+        append = recommender.MovieIndex._append
+        calls = []
+
+        def flaky_append(index, df):
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            return append(index, df)
+
+        make_rows(40, 3, seed=2).to_csv(self.path, mode='a', header=False, index=False)
+        with mock.patch.object(recommender.MovieIndex, '_append', flaky_append):
+            with self.assertRaises(recommender.DatasetError):
+                index.refresh()
+            self.assertEqual(index.matrix.shape[0], 40)
+            self.assertIsNone(index.recommend(41))
+
+            index.refresh()
+        self.assertEqual(index.matrix.shape[0], 43)
+        self.assertNeighboursMatchRebuild(index)
+
+    def test_concurrent_appends_keep_csv_intact(self):
+        threads = [
+            threading.Thread(target=recommender.append_rows, args=(self.dataset, make_rows(100 + i * 10, 10, seed=i)))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        df = pd.read_csv(self.path)
+        self.assertEqual(len(df), 120)
+        self.assertEqual(df['movie_id'].nunique(), 120)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, count, target):
+        results, errors = [], []
+
+        def run():
+            try:
+                results.append(target())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_callers_share_one_call(self):
+        inflight = SingleFlight(timeout=5)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 42
+
+        results, errors = self.run_concurrently(10, lambda: inflight.do('key', compute))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [42] * 10)
+        self.assertEqual(errors, [])
+
+    def test_error_is_shared_as_separate_exceptions(self):
+        inflight = SingleFlight(timeout=5)
+
+        def compute():
+            time.sleep(0.2)
+            raise recommender.DatasetError("Dataset must contain columns", 400)
+
+        results, errors = self.run_concurrently(5, lambda: inflight.do('key', compute))
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 5)
+        self.assertEqual(len({id(error) for error in errors}), 5)
+        for error in errors:
+            self.assertIsInstance(error, recommender.DatasetError)
+            self.assertEqual(error.status_code, 400)
+        followers = [error for error in errors if error.__cause__ is not None]
+        self.assertEqual(len(followers), 4)
+
+    def test_follower_gives_up_after_timeout(self):
+        inflight = SingleFlight(timeout=0.05)
+        release = threading.Event()
+        leader = threading.Thread(target=inflight.do, args=('key', release.wait))
+        leader.start()
+        time.sleep(0.05)
+        try:
+            with self.assertRaises(Overloaded):
+                inflight.do('key', lambda: None)
+        finally:
+            release.set()
+            leader.join()
+
+    def test_new_call_after_completion(self):
+        inflight = SingleFlight(timeout=5)
+        self.assertEqual(inflight.do('key', lambda: 1), 1)
+        self.assertEqual(inflight.do('key', lambda: 2), 2)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'versions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'versions'},
+})
+class ConcurrencyLimiterTests(TestCase):
+    databases = '__all__'
+
+    def test_slot_times_out(self):
+        limiter = ConcurrencyLimiter(1, timeout=0.01)
+        with limiter.slot():
+            with self.assertRaises(Overloaded):
+                with limiter.slot():
+                    pass
+        with limiter.slot():
+            pass
+
+    @override_settings(RECOMMENDER_RETRY_AFTER=3)
+    def test_view_sheds_load_with_retry_after(self):
+        Dataset.objects.create(name='movies', file='datasets/movies.csv')
+        limiter = ConcurrencyLimiter(1, timeout=0.01)
+        with mock.patch.object(views, 'scoring_limiter', limiter), limiter.slot():
+            response = self.client.get('/api/suggestion/', {'movie_id': '1'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(max_size=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(len(lru), 2)
+
+    def test_expires_entries(self):
+        lru = LRUCache(max_size=2, ttl=60)
+        lru.set('a', 1, ttl=0.01)
+        lru.set('b', 2)
+        time.sleep(0.02)
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.get('b'), 2)
+
+
+class RecommendationCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # File-based stand-ins for a cache shared between processes
+        caches = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': os.path.join(directory.name, 'default'),
+                'OPTIONS': {'MAX_ENTRIES': 5},
+            },
+            'versions': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': os.path.join(directory.name, 'versions'),
+            },
+        }
+        override = override_settings(CACHES=caches, RECOMMENDATION_CACHE_SIZE=10, RECOMMENDATION_CACHE_TTL=60)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.cache = RecommendationCache()
+
+    def test_counts_local_and_shared_hits(self):
+        key = self.cache.key('movies', 1, '10', 5)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, [{"movie_id": 11}])
+        self.assertEqual(self.cache.get(key), [{"movie_id": 11}])
+
+        # Another process only shares the file-based tier
+        other = RecommendationCache()
+        self.assertEqual(other.get(key), [{"movie_id": 11}])
+        self.assertEqual(other.get(key), [{"movie_id": 11}])
+
+        self.assertEqual(self.cache.stats()["misses"], 1)
+        self.assertEqual(self.cache.stats()["local_hits"], 1)
+        self.assertEqual(other.stats()["shared_hits"], 1)
+        self.assertEqual(other.stats()["local_hits"], 1)
+
+    def test_invalidate_moves_to_new_keys(self):
+        key = self.cache.key('movies', 1, '10', 5)
+        self.cache.set(key, [])
+        self.cache.invalidate()
+        new_key = self.cache.key('movies', 1, '10', 5)
+        self.assertNotEqual(key, new_key)
+        self.assertIsNone(self.cache.get(new_key))
+
+    def test_version_survives_culling_results(self):
+        version = self.cache.version()
+        for movie_id in range(20):
+            self.cache.set(self.cache.key('movies', 1, str(movie_id), 5), [])
+        self.assertEqual(self.cache.version(), version)
+
+    def test_shared_hit_keeps_remaining_ttl_locally(self):
+        key = self.cache.key('movies', 1, '10', 5)
+        self.cache.set(key, [], timeout=0.5)
+
+        other = RecommendationCache()
+        self.assertEqual(other.get(key), [])
+        time.sleep(0.6)
+        self.assertIsNone(other.get(key))
+        self.assertEqual(other.stats()["local_hits"], 0)
+
+    def test_partial_results_get_short_ttl(self):
+        with override_settings(RECOMMENDATION_PARTIAL_CACHE_TTL=7), \
+                mock.patch.object(views, 'recommendation_cache', self.cache), \
+                mock.patch.object(self.cache, 'set') as cache_set:
+            views.cached_recommendations('partial', lambda: ([{"poster_url": None}], True))
+            views.cached_recommendations('complete', lambda: ([{"poster_url": None}], False))
+        cache_set.assert_has_calls([
+            mock.call('partial', [{"poster_url": None}], timeout=7),
+            mock.call('complete', [{"poster_url": None}], timeout=None),
+        ])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class FetchPosterTests(SimpleTestCase):
+    def setUp(self):
+        views.cache.clear()
+
+    def tmdb_response(self, poster_path):
+        response = mock.Mock()
+        response.json.return_value = {'poster_path': poster_path}
+        return response
+
+    def test_caches_poster(self):
+        with mock.patch.object(views.requests, 'get', return_value=self.tmdb_response('a.jpg')) as get:
+            self.assertEqual(views.fetch_poster(1), "https://image.tmdb.org/t/p/w500/a.jpg")
+            self.assertEqual(views.fetch_poster(1), "https://image.tmdb.org/t/p/w500/a.jpg")
+        self.assertEqual(get.call_count, 1)
+
+    def test_caches_missing_poster(self):
+        with mock.patch.object(views.requests, 'get', return_value=self.tmdb_response(None)) as get:
+            self.assertIsNone(views.fetch_poster(1))
+            self.assertIsNone(views.fetch_poster(1))
+        self.assertEqual(get.call_count, 1)
+
+    def test_failure_is_not_cached(self):
+        error = views.requests.exceptions.ConnectionError()
+        with mock.patch.object(views.requests, 'get', side_effect=error) as get:
+            self.assertIs(views.fetch_poster(1), views.POSTER_FAILED)
+            self.assertIs(views.fetch_poster(1), views.POSTER_FAILED)
+        self.assertEqual(get.call_count, 2)
+
+
+@override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'versions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'versions'},
+    },
+    RECOMMENDER_NEIGHBOURS=5,
+    RECOMMENDER_REBUILD_THRESHOLD=10,
+)
+class DatasetAppendViewTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(MEDIA_ROOT=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(recommender._indexes.clear)
+
+        csv = make_rows(0, 40, seed=1).to_csv(index=False).encode()
+        self.dataset = Dataset.objects.create(name='movies', file=SimpleUploadedFile('movies.csv', csv))
+
+    def post_rows(self, csv):
+        upload = SimpleUploadedFile('rows.csv', csv.encode(), content_type='text/csv')
+        return self.client.post(f'/api/datasets/{self.dataset.pk}/append/', {'file': upload})
+
+    def test_appended_movies_are_recommended(self):
+        self.assertEqual(self.client.get('/api/movies/', {'movie_id': '1'}).status_code, 200)
+        self.assertEqual(self.client.get('/api/movies/', {'movie_id': '45'}).status_code, 404)
+
+        response = self.post_rows(make_rows(40, 8, seed=2).to_csv(index=False))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['appended_rows'], 8)
+
+        response = self.client.get('/api/movies/', {'movie_id': '45'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['recommendations']), 5)
+
+    def test_rejects_rows_without_integer_movie_id(self):
+        for movie_id in ['', 'abc', '1.5']:
+            response = self.post_rows(f"movie_id,title,cast,crew\n41,Movie41,a,b\n{movie_id},Movie,a,b\n")
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(pd.read_csv(self.dataset.file.path)), 40)
+
+    def test_rejects_missing_columns(self):
+        response = self.post_rows("movie_id,title\n41,Movie41\n")
+        self.assertEqual(response.status_code, 400)
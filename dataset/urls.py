@@ -4,7 +4,9 @@ from .views import *
 
 urlpatterns = [
     path('datasets/', DatasetCreateView.as_view(), name='dataset-create'),
+    path('datasets/<int:pk>/append/', DatasetAppendView.as_view(), name='dataset-append'),
     path('movies/', MovieRecommendationView.as_view(), name='movie-recommendations'),
     path('suggestion/', MovieSuggestView.as_view(), name='movie-recommendations'),
     path('dataset/', MovieListView.as_view(), name='list-movies-from-datasets'),
+    path('recommendations/cache/', RecommendationCacheStatsView.as_view(), name='recommendation-cache-stats'),
 ]
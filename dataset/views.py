@@ -4,20 +4,68 @@ from rest_framework import status
 from .models import Dataset
 from .serializers import *
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
 from django.views import View
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 import csv
 import requests
-import json
+from django.conf import settings
+from django.core.cache import cache
+from . import recommender
+from .cache import recommendation_cache
+from .concurrency import ConcurrencyLimiter, Overloaded, SingleFlight
+
+# Concurrent identical recommendation requests share one computation, and the
+# scoring itself is capped per process so bursts queue briefly then get a 503
+inflight = SingleFlight(settings.RECOMMENDER_COALESCE_TIMEOUT)
+scoring_limiter = ConcurrencyLimiter(settings.RECOMMENDER_MAX_CONCURRENCY, settings.RECOMMENDER_QUEUE_TIMEOUT)
+
+
+def score_movie(dataset_obj, kind, movie_id):
+    """
+    Top 5 similar movies for `movie_id`, or None if it is not in the dataset.
+    """
+    with scoring_limiter.slot():
+        # Load (or incrementally refresh) the similarity index for the dataset
+        index = recommender.get_index(dataset_obj, kind)
+        return index.recommend(movie_id, limit=5)
+
+
+def cached_recommendations(key, compute):
+    """
+    Serve recommendations from the result cache, computing them once on a miss.
+
+    `compute` returns (recommendations, partial); partial results are only
+    cached briefly.
+    """
+    recommendations = recommendation_cache.get(key)
+    if recommendations is not None:
+        return recommendations
+
+    def compute_and_store():
+        recommendations, partial = compute()
+        if recommendations is not None:
+            timeout = settings.RECOMMENDATION_PARTIAL_CACHE_TTL if partial else None
+            recommendation_cache.set(key, recommendations, timeout=timeout)
+        return recommendations
+
+    return inflight.do(key, compute_and_store)
+
+
+def overloaded_response():
+    return Response(
+        {"error": "Too many recommendation requests, please retry shortly."},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(settings.RECOMMENDER_RETRY_AFTER)},
+    )
 
 class DatasetCreateView(APIView):
     def post(self, request, *args, **kwargs):
         serializer = DatasetSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
+            # A new upload invalidates every cached recommendation
+            recommendation_cache.invalidate()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -27,6 +75,40 @@ class DatasetCreateView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class DatasetAppendView(APIView):
+    def post(self, request, pk, *args, **kwargs):
+        dataset_obj = get_object_or_404(Dataset, pk=pk)
+        serializer = DatasetAppendSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Load the rows to append
+        try:
+            new_rows = pd.read_csv(serializer.validated_data['file'], dtype={'movie_id': str})
+        except Exception as e:
+            return Response({"error": f"Failed to load rows: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Validate required columns
+        if not recommender.REQUIRED_COLUMNS.issubset(new_rows.columns):
+            return Response({"error": f"Rows must contain columns: {recommender.REQUIRED_COLUMNS}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Every appended row needs an integer movie_id to be looked up by
+        movie_ids = new_rows['movie_id']
+        if not movie_ids.notna().all() or not movie_ids.str.strip().str.fullmatch(r'\d+').all():
+            return Response({"error": "Every row must have an integer movie_id."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Append to the dataset file and patch the loaded similarity indexes
+        try:
+            recommender.append_rows(dataset_obj, new_rows)
+        except recommender.DatasetError as e:
+            return Response({"error": e.message}, status=e.status_code)
+        finally:
+            # The rows may be in the file even if refreshing the index failed
+            recommendation_cache.invalidate()
+
+        return Response({"id": dataset_obj.id, "appended_rows": len(new_rows)}, status=status.HTTP_200_OK)
+
+
 class MovieRecommendationView(APIView):
     def get(self, request, *args, **kwargs):
         # Ensure a movie ID is passed in the query params
@@ -39,52 +121,28 @@ class MovieRecommendationView(APIView):
         if not dataset_obj:
             return Response({"error": "Dataset not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Load the dataset CSV
-        file_path = dataset_obj.file.path
+        # Retrieve top recommendations (excluding the movie itself)
+        key = recommendation_cache.key('movies', dataset_obj.pk, movie_id.strip(), 5)
         try:
-            df = pd.read_csv(file_path)
-        except Exception as e:
-            return Response({"error": f"Failed to load dataset: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        # Validate required columns
-        required_columns = {'movie_id', 'title', 'cast', 'crew'}
-        if not required_columns.issubset(df.columns):
-            return Response({"error": f"Dataset must contain columns: {required_columns}"}, status=status.HTTP_400_BAD_REQUEST)
+            recommendations = cached_recommendations(key, lambda: (score_movie(dataset_obj, 'raw', movie_id), False))
+        except Overloaded:
+            return overloaded_response()
+        except recommender.DatasetError as e:
+            return Response({"error": e.message}, status=e.status_code)
 
-        # Combine relevant fields into a single text column
-        df['combined'] = df['title'].fillna('') + ' ' + df['cast'].fillna('') + ' ' + df['crew'].fillna('')
-
-        # Check if movie_id exists in the dataset
-        if movie_id not in df['movie_id'].astype(str).values:
+        if recommendations is None:
             return Response({"error": f"Movie ID {movie_id} not found in the dataset."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Vectorize the combined text
-        tfidf = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = tfidf.fit_transform(df['combined'])
-
-        # Calculate cosine similarity
-        cosine_sim = cosine_similarity(tfidf_matrix)
-
-        # Find the index of the given movie_id
-        movie_idx = df[df['movie_id'] == int(movie_id)].index[0]
-
-        # Get similarity scores for the given movie
-        sim_scores = list(enumerate(cosine_sim[movie_idx]))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-
-        # Retrieve top recommendations (excluding the movie itself)
-        top_recommendations = sim_scores[1:6]  # Top 5 similar movies
-        recommendations = []
-        for idx, score in top_recommendations:
-            recommendations.append({
-                "movie_id": df.iloc[idx]['movie_id'],
-                "title": df.iloc[idx]['title'],
-                "similarity_score": score
-            })
-
         # Return recommendations
         return Response({"movie_id": movie_id, "recommendations": recommendations}, status=status.HTTP_200_OK)
 
+class RecommendationCacheStatsView(APIView):
+    def get(self, request):
+        """
+        Report this process's recommendation cache hit/miss counters.
+        """
+        return Response(recommendation_cache.stats(), status=status.HTTP_200_OK)
+
 class MovieListView(APIView):
     def get(self, request):
         """
@@ -125,19 +183,29 @@ class MovieListView(APIView):
         # Return the list of all movies from all datasets
         return Response(all_movies)
 
+# Returned by fetch_poster when TMDB could not be asked, as opposed to None
+# for a movie TMDB has no poster for
+POSTER_FAILED = object()
+
 def fetch_poster(movie_id):
+    cache_key = f"poster:{movie_id}"
+    poster_url = cache.get(cache_key)
+    if poster_url is not None:
+        # '' is the cached answer for "TMDB has no poster"
+        return poster_url or None
+
     url = "https://api.themoviedb.org/3/movie/{}?api_key=8265bd1679663a7ea12ac168da84d2e8&language=en-US".format(movie_id)
     try:
-        data = requests.get(url)
+        data = requests.get(url, timeout=settings.POSTER_FETCH_TIMEOUT)
         data.raise_for_status()
         data = data.json()
-        poster_path = data.get('poster_path')
-        if poster_path:
-            return "https://image.tmdb.org/t/p/w500/" + poster_path
-        else:
-            return None
     except requests.exceptions.RequestException:
-        return None
+        return POSTER_FAILED
+
+    poster_path = data.get('poster_path')
+    poster_url = "https://image.tmdb.org/t/p/w500/" + poster_path if poster_path else ''
+    cache.set(cache_key, poster_url, timeout=settings.POSTER_CACHE_TTL)
+    return poster_url or None
 
 class MovieSuggestView(APIView):
     def get(self, request, *args, **kwargs):
@@ -151,74 +219,32 @@ class MovieSuggestView(APIView):
         if not dataset_obj:
             return Response({"error": "Dataset not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Load the dataset CSV
-        file_path = dataset_obj.file.path
-        try:
-            df = pd.read_csv(file_path)
-        except Exception as e:
-            return Response({"error": f"Failed to load dataset: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        # Validate required columns
-        required_columns = {'movie_id', 'title', 'cast', 'crew'}
-        if not required_columns.issubset(df.columns):
-            return Response({"error": f"Dataset must contain columns: {required_columns}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Function to extract cast names from the nested 'cast' column
-        def extract_cast_names(cast_column):
-            try:
-                cast_data = json.loads(cast_column)  # assuming the 'cast' column is a JSON string
-                return ' '.join([actor['name'] for actor in cast_data if 'name' in actor])
-            except (json.JSONDecodeError, TypeError):
-                return ''
+        def suggest():
+            # Score against the index built from cast and crew names
+            recommendations = score_movie(dataset_obj, 'names', movie_id)
+            partial = False
+            for recommendation in recommendations or []:
+                # Fetch poster for each recommended movie
+                poster_url = fetch_poster(recommendation["movie_id"])
+                if poster_url is POSTER_FAILED:
+                    # A passing TMDB failure, so the result is retried soon
+                    partial = True
+                    poster_url = None
+                recommendation["poster_url"] = poster_url
+            return recommendations, partial
 
-        # Function to extract crew roles from the nested 'crew' column
-        def extract_crew_roles(crew_column):
-            try:
-                crew_data = json.loads(crew_column)  # assuming the 'crew' column is a JSON string
-                return ' '.join([crew_member['name'] for crew_member in crew_data if 'name' in crew_member])
-            except (json.JSONDecodeError, TypeError):
-                return ''
-
-        # Apply the extraction functions to the cast and crew columns
-        df['cast_names'] = df['cast'].apply(extract_cast_names)
-        df['crew_roles'] = df['crew'].apply(extract_crew_roles)
-
-        # Combine relevant fields into a single text column
-        df['combined'] = df['title'].fillna('') + ' ' + df['cast_names'].fillna('') + ' ' + df['crew_roles'].fillna('')
+        # Retrieve top recommendations (excluding the movie itself)
+        # Posters are cached along with the recommendations
+        key = recommendation_cache.key('suggestion', dataset_obj.pk, movie_id.strip(), 5)
+        try:
+            recommendations = cached_recommendations(key, suggest)
+        except Overloaded:
+            return overloaded_response()
+        except recommender.DatasetError as e:
+            return Response({"error": e.message}, status=e.status_code)
 
-        # Check if movie_id exists in the dataset
-        if int(movie_id) not in df['movie_id'].values:
+        if recommendations is None:
             return Response({"error": f"Movie ID {movie_id} not found in the dataset."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Vectorize the combined text
-        tfidf = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = tfidf.fit_transform(df['combined'])
-
-        # Calculate cosine similarity
-        cosine_sim = cosine_similarity(tfidf_matrix)
-
-        # Find the index of the given movie_id
-        movie_idx = df[df['movie_id'] == int(movie_id)].index[0]
-
-        # Get similarity scores for the given movie
-        sim_scores = list(enumerate(cosine_sim[movie_idx]))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-
-        # Retrieve top recommendations (excluding the movie itself)
-        top_recommendations = sim_scores[1:6]  # Top 5 similar movies
-        recommendations = []
-        for idx, score in top_recommendations:
-            recommended_movie = df.iloc[idx]
-            # Fetch poster (add your fetch_poster logic here)
-            poster_url = fetch_poster(recommended_movie['movie_id'])
-
-            # Add the recommendation to the list
-            recommendations.append({
-                "movie_id": recommended_movie['movie_id'],
-                "title": recommended_movie['title'],
-                "poster_url": poster_url,
-                "similarity_score": score
-            })
-
         # Return recommendations
-        return Response({"movie_id": movie_id, "recommendations": recommendations}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response({"movie_id": movie_id, "recommendations": recommendations}, status=status.HTTP_200_OK)
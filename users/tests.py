@@ -1,3 +1,65 @@
-from django.test import TestCase
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.db import connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from backend.routers import reset_pin
+from users.models import CustomUser
+
+
+# TransactionTestCase, since TestCase wraps every test in atomic() and the
+# router keeps reads inside a transaction on the primary
+@skipUnless('replica' in settings.DATABASES, "Run with DJANGO_SQLITE=1 for the replica stand-in")
+class PrimaryReplicaRouterTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='secret')
+        reset_pin()
+        self.addCleanup(reset_pin)
+
+    def test_reads_go_to_replica(self):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            self.assertTrue(CustomUser.objects.filter(email='user@example.com').exists())
+        self.assertEqual(len(replica_queries), 1)
+
+    def test_reads_after_write_stay_on_primary(self):
+        CustomUser.objects.create_user(email='other@example.com', password='secret')
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            self.assertEqual(CustomUser.objects.count(), 2)
+        self.assertEqual(len(replica_queries), 0)
+
+    def test_reads_in_transaction_stay_on_primary(self):
+        with transaction.atomic():
+            self.assertEqual(CustomUser.objects.all().db, 'default')
+
+    def test_writes_go_to_primary(self):
+        with CaptureQueriesContext(connections['default']) as default_queries:
+            CustomUser.objects.filter(pk=self.user.pk).update(first_name='Updated')
+        self.assertEqual(len(default_queries), 1)
+
+    def test_each_request_starts_unpinned(self):
+        # Registering writes and pins, the next request reads from the replica again
+        response = self.client.post('/api/register', {
+            'email': 'new@example.com', 'first_name': 'New', 'last_name': 'User', 'password': 'secret',
+        })
+        self.assertEqual(response.status_code, 201)
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(f'/api/role/{self.user.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['role'], 'user')
+        self.assertEqual(len(replica_queries), 1)
+
+    @override_settings(QUERY_REPORT_HEADERS=True)
+    def test_query_report_headers(self):
+        response = self.client.get(f'/api/role/{self.user.pk}')
+        self.assertEqual(response['X-DB-Queries'], 'replica=1')
+        self.assertIn('db;desc="1 queries"', response['Server-Timing'])
+
+    @override_settings(QUERY_REPORT_HEADERS=False)
+    def test_query_report_headers_off(self):
+        response = self.client.get(f'/api/role/{self.user.pk}')
+        self.assertNotIn('X-DB-Queries', response)
+        self.assertNotIn('Server-Timing', response)